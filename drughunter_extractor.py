@@ -1,14 +1,14 @@
+import re
 from argparse import ArgumentParser
 from calendar import month_name
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hashlib import blake2b
 
 from export.export_results import export_to_csv
 from export.remove_duplicates import remove_duplicates
 from pdf_extraction.pdf_extraction import download_pdf
-from recognition.recognize_segments_decimer import \
-    recognize_segments as recognize_segments_decimer
-from recognition.recognize_segments_molscribe import \
-    recognize_segments as recognize_segments_molscribe
-from segmentation.segment_pdf import segment_pdf
+from segmentation.segment_pdf import iter_segment_pdf
 from validation.validate_with_chembl_webresource import validate_inchikey_list
 
 
@@ -31,18 +31,19 @@ def get_information_from_descriptions(descriptions : list[str], separator : str)
     It could be possible to handle that to increase correct name, target proposal rate
     """
 
+    # first line containing the separator, split into NAME and TARGET at the separator
+    separator_line = re.compile(rf'^([^\n]*?){re.escape(separator)}([^\n]*)$', re.MULTILINE)
+
     proposed_names, porposed_targets = [], []
     for description in descriptions:
         proposed_name, porposed_target = '', ''
-        text_lines = description.split('\n')
-        for text_line in text_lines:
-            if separator in text_line:
-                proposed_name, porposed_target = text_line.split(separator)
-                break
+        match = separator_line.search(description)
+        if match:
+            proposed_name, porposed_target = match.groups()
 
         if proposed_name == '':
-            if len(text_lines) >= 1:
-                proposed_name = text_lines[0]
+            text_lines = description.split('\n', 2)
+            proposed_name = text_lines[0]
             if len(text_lines) >= 2:
                 porposed_target = text_lines[1]
                 
@@ -57,13 +58,32 @@ def get_information_from_descriptions(descriptions : list[str], separator : str)
     return information
 
 
+def hash_segment(segment) -> bytes:
+    """
+    Hash the pixels of a segment, identical segments (e.g. a molecule repeated across posters) share the hash
+
+    Params:
+    - segment (np.ndarray): image segment
+
+    Returns:
+    - 16 byte digest of the segment's shape and pixels
+    """
+    segment_hash = blake2b(str(segment.shape).encode(), digest_size=16)
+    segment_hash.update(segment.tobytes())
+    return segment_hash.digest()
+
+
 def extract_molecules_from_pdfs(pdfs : list[tuple[str, bytes]], 
                                 target_segment_directory : str = None, 
                                 decimer_complement : bool = True,
                                 get_text : bool = False,
                                 text_direction : str = 'right',
                                 molecules_of_the_month : bool = True,
-                                separator : str = '|'
+                                separator : str = '|',
+                                segmentation_workers : int = 2,
+                                dpi : int = 300,
+                                thread_count : int = None,
+                                compile_encoder : bool = False
                                 ) -> None:
     """
     Extract molecules from a list of PDFs 
@@ -72,61 +92,159 @@ def extract_molecules_from_pdfs(pdfs : list[tuple[str, bytes]],
     - pdfs (List[Tuple[str, bytes]]): A list of tuples containing the source file name and the content of the PDF.
       Each tuple represents one PDF to be processed.
     - target_segment_directory (str): Path to the directory that segments segmented with decimer are saved to
+    - segmentation_workers (int): Number of processes segmenting PDFs in parallel, each one loads its own segmentation model
+    - dpi (int): Resolution the PDF pages are rasterized at, lower values are faster but may miss small structures
+    - thread_count (int): Number of poppler threads rasterizing each PDF, defaults to splitting the CPUs between the workers
+    - compile_encoder (bool): If True, the MolScribe encoder is compiled with torch.compile (CUDA only), pays off for larger sets
 
     Returns:
     - Nothing, instead saves the results into a timestamped csv file
     - prints rates of successful and unsuccessful recognitions using Molscribe and Decimer.
     """
+    # the molscribe module pulls in torch, it is imported only once it is needed
+    from recognition.recognize_segments_molscribe import \
+        recognize_segments as recognize_segments_molscribe
 
-    extraction_results = {}
-
-    # segmentation_results -> list of tuples (source filename, segment)
-    segmentation_results, descriptions = segment_pdf(pdfs, target_segment_directory=target_segment_directory, get_text=get_text, molecules_of_the_month=molecules_of_the_month, text_direction=text_direction) 
-
-    # get get results of segmentation
     extraction_results = {
-        'source': [source_filename for source_filename, _, _, _ in segmentation_results],
-        'page number': [page_number for _, page_number, _, _ in segmentation_results],
-        'segment number': [segment_number for _, _, segment_number, _ in segmentation_results]
+        'source': [],
+        'page number': [],
+        'segment number': []
     }
-
-    segments = [segment for _, _, _, segment in segmentation_results]
+    segments, segment_hashes, descriptions = [], [], []
+    recognition_results_molscribe = {
+        'smiles': [],
+        'inchi': [],
+        'inchikey': []
+    }
+    # segment hash -> molscribe recognition of the segment
+    recognized_segments = {}
+
+    # segmentation_results -> list of tuples (source filename, page number, segment number, segment) of a single pdf
+    # pdfs keep being segmented in worker processes while the already segmented ones are recognized
+    print("Segmenting...")
+    for segmentation_results, pdf_descriptions in iter_segment_pdf(pdfs, target_segment_directory=target_segment_directory, get_text=get_text, molecules_of_the_month=molecules_of_the_month, text_direction=text_direction, max_workers=segmentation_workers, dpi=dpi, thread_count=thread_count):
+        descriptions += pdf_descriptions
+        if not segmentation_results:
+            continue
+
+        # get get results of segmentation
+        source_filenames, page_numbers, segment_numbers, pdf_segments = map(list, zip(*segmentation_results))
+        extraction_results['source'] += source_filenames
+        extraction_results['page number'] += page_numbers
+        extraction_results['segment number'] += segment_numbers
+        segments += pdf_segments
+
+        pdf_segment_hashes = [hash_segment(segment) for segment in pdf_segments]
+        segment_hashes += pdf_segment_hashes
+
+        # recognize with Molscribe, segments that were already seen are not recognized again
+        unseen_segments = {
+            segment_hash: segment 
+            for segment_hash, segment in zip(pdf_segment_hashes, pdf_segments) 
+            if segment_hash not in recognized_segments
+        }
+        if unseen_segments:
+            unseen_results = recognize_segments_molscribe(list(unseen_segments.values()), compile_encoder=compile_encoder)
+            for index, segment_hash in enumerate(unseen_segments):
+                recognized_segments[segment_hash] = {key: values[index] for key, values in unseen_results.items()}
+
+        for segment_hash in pdf_segment_hashes:
+            for key, value in recognized_segments[segment_hash].items():
+                recognition_results_molscribe[key].append(value)
+
+    print(f"{len(segments)} segments were segmented.")
     if (descriptions):
         extraction_results.update(get_information_from_descriptions(descriptions, separator))
 
-    
-    # recognize with Molscribe
-    recognition_results_molscribe = recognize_segments_molscribe(segments)
+    # decimer runs in a single background thread so that it can recognize segments while unichem validates,
+    # the single worker also keeps decimer calls (which share a temporary file) from overlapping
+    decimer_executor = ThreadPoolExecutor(max_workers=1) if decimer_complement else None
+    # list of tuples (hashes of the submitted segments, future of their decimer recognition)
+    decimer_jobs = []
 
-    # validate results with unichem
-    recognition_results_molscribe['validation'] = validate_inchikey_list(recognition_results_molscribe.get('inchikey'))
+    def submit_to_decimer(segments_to_recognize : dict) -> None:
+        # DECIMER and tensorflow are imported inside the wrapper's recognize_segments, on its first call
+        from recognition.recognize_segments_decimer import \
+            recognize_segments as recognize_segments_decimer
 
-    # print rates
-    if recognition_results_molscribe['validation']:
-        print(f"Molscribe succesfully recognized {recognition_results_molscribe['validation'].count(True)} segments. \
-            ({round(recognition_results_molscribe['validation'].count(True)/len(recognition_results_molscribe['validation'])*100, 2)} % success rate)")
-        print(f"Molscribe could not recognize {recognition_results_molscribe['validation'].count(False)} segments. Attemping to recognize them with decimer.")
-   
-    if decimer_complement:
-        # get indexes of invalidated segments
-        index_list = [index for index, validation_result in enumerate(recognition_results_molscribe['validation']) if validation_result is False]
-
-        # recognize with decimer
-        if index_list:
-            recognition_results_decimer = recognize_segments_decimer([segment for index, segment in enumerate(segments) if index in index_list ])
-
-
-            # validate results with unichem
-            recognition_results_decimer['validation'] = validate_inchikey_list(recognition_results_decimer.get('inchikey'))
-            
-            print(f"Decimer managed to recognize {recognition_results_decimer['validation'].count(True)} more segments.")
-
-            # complement molscribe unsuccessful recognitions with successful decimer recognitions
-            for index, validation_result in enumerate(recognition_results_decimer['validation']):
-                # if decimer got better result that molscribe
-                if validation_result is True or (recognition_results_decimer['inchikey'] != '' and recognition_results_molscribe['inchikey'] == ''):
-                    for key in ['smiles', 'inchi', 'inchikey', 'validation']:
-                        recognition_results_molscribe[key][index_list[index]] = recognition_results_decimer[key][index]
+        decimer_jobs.append((
+            list(segments_to_recognize),
+            decimer_executor.submit(recognize_segments_decimer, list(segments_to_recognize.values()))
+        ))
+
+    try:
+        # molscribe results without an inchikey can not be valid, decimer starts on them right away
+        unparsed_segments = {}
+        if decimer_complement:
+            unparsed_segments = {
+                segment_hashes[index]: segments[index] 
+                for index, inchikey in enumerate(recognition_results_molscribe['inchikey']) 
+                if not inchikey
+            }
+            if unparsed_segments:
+                submit_to_decimer(unparsed_segments)
+
+        # validate results with unichem
+        recognition_results_molscribe['validation'] = validate_inchikey_list(recognition_results_molscribe.get('inchikey'))
+
+        # print rates
+        if recognition_results_molscribe['validation']:
+            validated_count = sum(recognition_results_molscribe['validation'])
+            total_count = len(recognition_results_molscribe['validation'])
+            print(f"Molscribe succesfully recognized {validated_count} segments. \
+            ({validated_count / total_count:.2%} success rate)")
+            print(f"Molscribe could not recognize {total_count - validated_count} segments. Attemping to recognize them with decimer.")
+
+        if decimer_complement:
+            # get indexes of invalidated segments
+            index_list = [index for index, validation_result in enumerate(recognition_results_molscribe['validation']) if validation_result is False]
+
+            # recognize the rest of the invalidated segments with decimer, identical segments are recognized only once
+            if index_list:
+                remaining_segments = {
+                    segment_hashes[index]: segments[index] 
+                    for index in index_list 
+                    if segment_hashes[index] not in unparsed_segments
+                }
+                if remaining_segments:
+                    submit_to_decimer(remaining_segments)
+
+                # gather decimer results in the order they were submitted
+                decimer_hashes = []
+                recognition_results_decimer = {
+                    'smiles': [],
+                    'inchi': [],
+                    'inchikey': []
+                }
+                for job_hashes, job in decimer_jobs:
+                    decimer_hashes += job_hashes
+                    for key, values in job.result().items():
+                        recognition_results_decimer[key] += values
+                decimer_indexes = {segment_hash: decimer_index for decimer_index, segment_hash in enumerate(decimer_hashes)}
+
+
+                # validate results with unichem
+                recognition_results_decimer['validation'] = validate_inchikey_list(recognition_results_decimer.get('inchikey'))
+
+                # counted per segment, identical segments were recognized only once
+                decimer_validated_count = sum(
+                    recognition_results_decimer['validation'][decimer_indexes[segment_hashes[index]]] 
+                    for index in index_list
+                )
+                print(f"Decimer managed to recognize {decimer_validated_count} more segments.")
+
+                # complement molscribe unsuccessful recognitions with successful decimer recognitions
+                for index in index_list:
+                    decimer_index = decimer_indexes[segment_hashes[index]]
+                    validation_result = recognition_results_decimer['validation'][decimer_index]
+                    # if decimer got better result that molscribe
+                    if validation_result is True or (recognition_results_decimer['inchikey'][decimer_index] != '' and recognition_results_molscribe['inchikey'][index] == ''):
+                        for key in ['smiles', 'inchi', 'inchikey', 'validation']:
+                            recognition_results_molscribe[key][index] = recognition_results_decimer[key][decimer_index]
+    finally:
+        # also on failure, so that queued decimer jobs are dropped instead of keeping the process alive
+        if decimer_executor is not None:
+            decimer_executor.shutdown(cancel_futures=True)
 
     # update and remove duplicates
     extraction_results.update(recognition_results_molscribe)
@@ -134,8 +252,9 @@ def extract_molecules_from_pdfs(pdfs : list[tuple[str, bytes]],
 
     # print rates
     if extraction_results['validation']:
-        print(f"{extraction_results['validation'].count(True)} segments recognized in total. \
-            ({round(extraction_results['validation'].count(True)/len(extraction_results['validation'])*100, 2)} % success rate)")
+        validated_count = sum(extraction_results['validation'])
+        print(f"{validated_count} segments recognized in total. \
+            ({validated_count / len(extraction_results['validation']):.2%} success rate)")
     
     if extraction_results:
         export_to_csv(extraction_results)
@@ -147,7 +266,11 @@ def extract_molecules_of_the_month(target_year : int,
                                    target_months : tuple[int, int], 
                                    target_segment_directory : str = None, 
                                    decimer_complement : bool = True,
-                                   get_text : bool = False
+                                   get_text : bool = False,
+                                   segmentation_workers : int = 2,
+                                   dpi : int = 300,
+                                   thread_count : int = None,
+                                   compile_encoder : bool = False
                                    ) -> None:
     """
     Extract from the Molecules of the Month DrugHunter sets for specified year and month range
@@ -156,6 +279,10 @@ def extract_molecules_of_the_month(target_year : int,
     - target_year (int): Year to extract molecules of the month.
     - target_months (str): Range of months, format either single number ('5'), or two numbers separated by a dash ('1-3')
     - target_segment_directory (str): Directory to save segmented pngs to
+    - segmentation_workers (int): Number of processes segmenting PDFs in parallel
+    - dpi (int): Resolution the PDF pages are rasterized at
+    - thread_count (int): Number of poppler threads rasterizing each PDF
+    - compile_encoder (bool): If True, the MolScribe encoder is compiled with torch.compile (CUDA only)
 
     Returns:
     - see documentation of extract_molecules_from_pdf
@@ -164,15 +291,14 @@ def extract_molecules_of_the_month(target_year : int,
     # get list of target urls
     urls = [f"https://drughunter.com/molecules-of-the-month/{target_year}/{month_name[index].lower()}-{target_year}" for index in range(target_months[0], target_months[1] + 1)]
     
-    # get pdfs to extract from
-    pdfs = []
-    for url in urls:
-        pdfs += download_pdf(url, download_all=True) 
-    
+    # get pdfs to extract from, months are downloaded concurrently
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        month_pdfs = list(executor.map(partial(download_pdf, download_all=True), urls))
+    pdfs = [pdf for pdfs_of_month in month_pdfs for pdf in pdfs_of_month]
 
     # get chemical info out of pdfs
     if pdfs:
-        extract_molecules_from_pdfs(pdfs, target_segment_directory=target_segment_directory, decimer_complement=decimer_complement, get_text=get_text, text_direction='right')
+        extract_molecules_from_pdfs(pdfs, target_segment_directory=target_segment_directory, decimer_complement=decimer_complement, get_text=get_text, text_direction='right', segmentation_workers=segmentation_workers, dpi=dpi, thread_count=thread_count, compile_encoder=compile_encoder)
 
 
 def extract_bounds(input_string : str) -> tuple[int, int]:
@@ -222,6 +348,10 @@ def main():
     parser.add_argument('--text', help='Turns on text extraction', action='store_true')
     parser.add_argument('--direction', type=str, help='Specifies in which direction the text is from the molecules', default='right')
     parser.add_argument('--separator', type=str, help='Specifies which separator is used in the document to separate name and target.', default='|')
+    parser.add_argument('--dpi', type=int, help='(int) resolution the pdf pages are rasterized at, lower values are faster but may miss small structures', default=300)
+    parser.add_argument('--threads', type=int, help='(int) number of poppler threads rasterizing each pdf, by default the cpus are split between the workers', default=None)
+    parser.add_argument('--compile', help='Compiles the MolScribe encoder with torch.compile (CUDA only), pays off for larger sets', action='store_true')
+    parser.add_argument('--workers', type=int, help='(int) number of processes segmenting pdfs in parallel, each loads its own segmentation model', default=2)
     args = parser.parse_args()
 
     
@@ -239,7 +369,11 @@ def main():
             get_text=args.text,
             text_direction=args.direction,
             molecules_of_the_month = False,
-            separator = args.separator
+            separator = args.separator,
+            segmentation_workers = args.workers,
+            dpi = args.dpi,
+            thread_count = args.threads,
+            compile_encoder = args.compile
             )
         return
     
@@ -265,7 +399,11 @@ def main():
         args.year, (lower_bound, upper_bound), 
         args.seg_dir, 
         decimer_complement=decimer_on, 
-        get_text=args.text)
+        get_text=args.text,
+        segmentation_workers=args.workers,
+        dpi=args.dpi,
+        thread_count=args.threads,
+        compile_encoder=args.compile)
     return
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-from pandas import DataFrame
+import csv
 from os.path import join as osp_join
 from time import strftime
 
@@ -8,16 +8,23 @@ def export_to_csv(to_export: dict, file_name: str = "", directory: str = "result
 
     Params:
         to_export (dict): A dictionary where keys are column names and values are lists of column values.
-                          ALL VALUE LISTS MUST BE OF THE SAME LENGTH TO CREATE A DATAFRAME.
+                          ALL VALUE LISTS MUST BE OF THE SAME LENGTH.
         file_name (str): Optional custom string appended before the timestamp in the resulting filename.
         directory (str): Optional custom target directory. The default value is "results" directory.
 
     """
     print("Exporting results...")
 
-    df = DataFrame(to_export)
+    columns = list(to_export.values())
+    if len({len(column) for column in columns}) > 1:
+        raise ValueError("All value lists must be of the same length.")
+
     # Create a CSV file in the specified directory with the given file name and timestamp
-    df.to_csv(osp_join(directory, file_name + strftime("%Y_%m_%d-%H_%M_%S") + ".csv")) 
+    # The first unnamed column holds the row index
+    with open(osp_join(directory, file_name + strftime("%Y_%m_%d-%H_%M_%S") + ".csv"), 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow(['', *to_export.keys()])
+        writer.writerows([index, *row] for index, row in enumerate(zip(*columns)))
 
 def main():
     # Example use:
@@ -2,6 +2,15 @@ import requests
 import os
 from bs4 import BeautifulSoup
 
+# shared session so that repeated requests to drughunter reuse the same connections
+session = requests.Session()
+# headers simulating a browser request are necessary, without them the request status code returns 403 (forbidden)
+session.headers.update({
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+})
+# enough pooled connections for the months downloaded concurrently by drughunter_extractor
+session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=16))
+
 
 def filter_pdf_links_by_choice(pdf_links : list) -> list:
     """
@@ -67,13 +76,8 @@ def download_pdf(url : str,
 
     print(f"Attempting to download pdf files from {url}")
 
-    # headers simulating a browser request are necessary, without them the request status code returns 403 (forbidden)
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
-
     try:
-        response = requests.get(url, headers=headers)
+        response = session.get(url)
         response.raise_for_status()  # Raise exception for non-200 status codes
     except requests.exceptions.RequestException as e:
         print("Failed to download the web page:", e)
@@ -97,7 +101,7 @@ def download_pdf(url : str,
 
     def download_file(file_url):
         try:
-            pdf_response = requests.get(file_url, headers=headers)
+            pdf_response = session.get(file_url)
             pdf_response.raise_for_status()
             return pdf_response.content
         except requests.exceptions.RequestException as e:
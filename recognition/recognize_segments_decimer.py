@@ -1,5 +1,7 @@
 import os
 
+import numpy as np
+from PIL import Image
 from rdkit import Chem
 from time import time
 
@@ -9,7 +11,7 @@ def recognize_segments(image_list: list) -> dict:
     Iterate through the image list and attempt to recognize each image using DECIMER as a SMILES string.
 
     Params:
-    - image_list (List[Image]): A list of images to recognize.
+    - image_list (List[np.ndarray | Image]): A list of images to recognize.
 
     Returns:
     - dict: A dictionary containing recognized properties for each image:
@@ -33,7 +35,7 @@ def recognize_segments(image_list: list) -> dict:
 
     for img in image_list:
         # Save the image as a temporary file
-        img.save("tmp.png")
+        Image.fromarray(np.asarray(img)).save("tmp.png")
 
         # Use DECIMER to predict the SMILES string for the image
         # predict_SMILES function requires a path to the image as input
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from multiprocessing import freeze_support
 
 import numpy as np
@@ -10,12 +11,47 @@ from huggingface_hub import hf_hub_download
 from chembl_structure_pipeline import standardizer
 from molscribe import MolScribe
 
-def recognize_segments(image_list: list) -> dict:
+@lru_cache(maxsize=1)
+def _get_model() -> MolScribe:
+    """
+    Load MolScribe once per process, later calls reuse the already loaded model.
+
+    Returns:
+        MolScribe: model on CUDA if available, otherwise on CPU
+    """
+    # Download the model checkpoint from Hugging Face model hub
+    ckpt_path = hf_hub_download('yujieq/MolScribe', 'swin_base_char_aux_1m.pth')
+
+    # Run on the GPU when there is one, letting matmuls use TF32 tensor cores
+    if torch.cuda.is_available():
+        device = torch.device('cuda')
+        torch.set_float32_matmul_precision('high')
+        torch.backends.cudnn.benchmark = True
+    else:
+        device = torch.device('cpu')
+    return MolScribe(ckpt_path, device=device)
+
+@lru_cache(maxsize=1)
+def _compile_encoder() -> None:
+    """
+    Compile the encoder of the loaded model in place with torch.compile, once per process and only on CUDA.
+
+    The encoder sees fixed size images, the autoregressive decoder is left eager.
+    """
+    if torch.cuda.is_available() and hasattr(torch, 'compile'):
+        model = _get_model()
+        model.encoder = torch.compile(model.encoder, mode='reduce-overhead')
+
+def recognize_segments(image_list: list, batch_size: int = 32, compile_encoder: bool = False) -> dict:
     """
     Recognize each image from a list using MolScribe.
 
     Params:
-        image_list (List[Image]): A list of images to recognize.
+        image_list (List[np.ndarray | Image]): A list of images to recognize.
+        batch_size (int): Number of images MolScribe runs through the model in a single forward pass.
+        compile_encoder (bool): If True, the image encoder is compiled with torch.compile when running on CUDA.
+                                Compilation takes a while, it pays off only for larger image lists
+                                or repeated calls, as the compiled encoder is kept for the rest of the process.
 
     Returns:
         dict: A dictionary with the structure:
@@ -32,13 +68,13 @@ def recognize_segments(image_list: list) -> dict:
     # Necessary for Windows compatibility with multiprocessing
     freeze_support()
 
-    # Download the model checkpoint from Hugging Face model hub
-    ckpt_path = hf_hub_download('yujieq/MolScribe', 'swin_base_char_aux_1m.pth')
-    model = MolScribe(ckpt_path, device=torch.device('cpu'))
+    model = _get_model()
+    if compile_encoder:
+        _compile_encoder()
 
     np_arr_list = [np.asarray(image) for image in image_list]
 
-    results_list = model.predict_images(np_arr_list)
+    results_list = model.predict_images(np_arr_list, batch_size=batch_size)
 
     output_dict = {}
 
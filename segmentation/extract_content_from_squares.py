@@ -26,30 +26,33 @@ def sort_segments_bboxes(
     """
     if bboxes == []:
         return segments, bboxes
+    # Indexes are sorted instead of the bounding boxes, so that segments can be picked up
+    # without searching for each bounding box in the list
     # Sort by y-coordinate (top-to-bottom reading order)
-    sorted_bboxes = sorted(bboxes, key=lambda bounding_box: bounding_box[0])
+    sorted_indexes = sorted(range(len(bboxes)), key=lambda index: bboxes[index][0])
 
     # Group bounding boxes by rows based on y-coordinate
     rows = []
-    current_row = [sorted_bboxes[0]]
-    for bounding_box in sorted_bboxes[1:]:
-        if abs(bounding_box[0] - current_row[-1][0]) < same_row_pctg_threshold:  # You can adjust this threshold as needed
-            current_row.append(bounding_box)
+    current_row = [sorted_indexes[0]]
+    for index in sorted_indexes[1:]:
+        if abs(bboxes[index][0] - bboxes[current_row[-1]][0]) < same_row_pctg_threshold:  # You can adjust this threshold as needed
+            current_row.append(index)
         else:
-            rows.append(sorted(current_row, key=lambda x: x[1]))  # Sort by x-coordinate within each row
-            current_row = [bounding_box]
-    rows.append(sorted(current_row, key=lambda x: x[1]))  # Sort the last row
+            rows.append(sorted(current_row, key=lambda x: bboxes[x][1]))  # Sort by x-coordinate within each row
+            current_row = [index]
+    rows.append(sorted(current_row, key=lambda x: bboxes[x][1]))  # Sort the last row
 
     # Flatten the list of rows and return
-    sorted_bboxes = [bounding_box for row in rows for bounding_box in row]
+    sorted_indexes = [index for row in rows for index in row]
 
-    sorted_segments = [segments[bboxes.index(bounding_box)] for bounding_box in sorted_bboxes]
+    sorted_segments = [segments[index] for index in sorted_indexes]
+    sorted_bboxes = [bboxes[index] for index in sorted_indexes]
     return sorted_segments, sorted_bboxes
 
 def extract_content_with_borders(page):
     images, bounding_boxes = [], []
 
-    image = np.array(page)  # Convert the PIL image to a NumPy array
+    image = np.asarray(page)  # View the PIL image or NumPy array as a NumPy array without copying
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     _, thresh = cv2.threshold(gray,50,255,0)
     contours, _ = cv2.findContours(thresh, 1, 2)
@@ -50,13 +50,12 @@ def extract_text_in_direction(
     return textboxes
 
 def extract_text(
-        path : str, 
+        doc : fitz.Document, 
         page_num : int, 
         bboxes : list[tuple],
         direction : str = 'right'
         ) -> list[str]:
     
-    doc = fitz.open(path)
     page = doc[page_num]
     textboxes = []
 
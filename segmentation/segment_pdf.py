@@ -1,4 +1,9 @@
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Iterator
+
+import fitz
 import numpy as np
 from pdf2image import convert_from_bytes
 from PIL import Image
@@ -6,108 +11,216 @@ from time import time
 from segmentation.extract_text import extract_text
 from segmentation.extract_content_from_squares import extract_content_with_borders
 
-def binarize_image(img):
-    width, height = img.size
-    
-    # Create a new image with the same dimensions
-    new_img = Image.new("RGB", (width, height))
-    
-    # Loop through each pixel in the image
-    for y in range(height):
-        for x in range(width):
-            # Get the RGB values of the pixel
-            r, g, b = img.getpixel((x, y))
-            
-            # Check if all RGB values are equal
-            if abs(r - g) + abs(r - b) + abs(b - g) < 20 and r + b + g < 700:
-                new_pixel = (r, g, b)
+def binarize_image(img : Image.Image) -> np.ndarray:
+    """
+    Keep the gray pixels of an image and set the colorful or too light ones to pure white.
+
+    Returns the binarized image as an RGB numpy array.
+    """
+    # the thresholds below assume RGB pixels, other modes are converted explicitly
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    pixels = np.asarray(img)
+    # Check if all RGB values are (almost) equal and the pixel is not too light,
+    # |r - g| + |r - b| + |b - g| < 20 is the same as a channel spread below 10, which fits in uint8,
+    # only the channel sum is widened to uint16 so that it does not overflow
+    is_gray = pixels.max(axis=2) - pixels.min(axis=2) < 10
+    is_gray &= pixels.sum(axis=2, dtype=np.uint16) < 700
+
+    binarized = pixels.copy()
+    np.copyto(binarized, np.uint8(255), where=~is_gray[..., None])  # Set pixel to pure white
+    return binarized
+
+def _save_segment(segment : np.ndarray, path : str) -> None:
+    Image.fromarray(segment).save(path, format='PNG', optimize=False, compress_level=1)
+
+def _segment_one_pdf(pdf : tuple[str, bytes],
+                     target_segment_directory : str = None,
+                     expand : bool = True,
+                     get_text : bool = False,
+                     molecules_of_the_month : bool = True,
+                     text_direction : str = 'right',
+                     dpi : int = 300,
+                     thread_count : int = 1
+                     ) -> tuple[
+                         list[tuple[str, int, int, np.ndarray]],
+                         list[str]
+                         ]:
+    """
+    Segment a single PDF, see segment_pdf for documentation of the parameters.
+
+    Kept at module level so that it can be pickled and run in a worker process.
+    """
+    filename, content = pdf
+
+    # process pdfs
+    try:
+        pages = convert_from_bytes(content, dpi=dpi, thread_count=thread_count)
+    except Exception as e:
+        print(f"Error while processing {filename}: {str(e)}")
+        return [], []
+
+    # call the segmentation function
+    # visualization can be set to True for a visual confirmation of the segmentation
+    # expand=True yields better results than expand=False
+    sub_segment_list = []
+    text_list = []
+    print(f"Attempting to segment {filename}")
+
+    # segments are encoded and written by threads while the next pages are segmented
+    if target_segment_directory:
+        os.makedirs(os.path.join(target_segment_directory, filename), exist_ok=True)
+        save_executor = ThreadPoolExecutor(max_workers=4)
+        save_futures = []
+
+    # the pdf is parsed once from memory and its pages are reused for text extraction
+    if get_text:
+        doc = fitz.open(stream=content, filetype='pdf')
+
+    for page_num, page in enumerate(pages):
+        segments = []
+        binarized_page = binarize_image(page)
+        if (molecules_of_the_month):
+            segments, bboxes = extract_content_with_borders(binarized_page)
+
+        if segments == []:
+            # imported inside the worker so that the model is never pickled between processes
+            from decimer_segmentation import segment_chemical_structures
+            segments, bboxes = segment_chemical_structures(binarized_page,
+                                                expand=expand,
+                                                visualization=False)
+
+        for segment_num, segment in enumerate(segments):
+            # segments can be views into the page, a copy lets the page be freed once it is processed
+            segment = segment.copy()
+
+            # save to specified directory, segments are numbered across the whole pdf
+            if target_segment_directory:
+                save_futures.append(save_executor.submit(
+                    _save_segment,
+                    segment,
+                    os.path.join(target_segment_directory, f"{filename}/{len(sub_segment_list)}.png")
+                ))
+            sub_segment_list.append((filename, page_num, segment_num, segment))
+
+        if get_text:
+            if molecules_of_the_month:
+                text_list += (extract_text(doc, page_num, bboxes, 'right'))
             else:
-                new_pixel = (255, 255, 255)  # Set pixel to pure white
-            
-            # Put the new pixel in the new image
-            new_img.putpixel((x, y), new_pixel)
-    
-    return new_img
+                text_list += (extract_text(doc, page_num, bboxes, text_direction))
+
+    if get_text:
+        doc.close()
+
+    print(f"Found {len(sub_segment_list)} segments in {filename}")
+
+    if target_segment_directory:
+        save_executor.shutdown(wait=True)
+        # re-raise saving errors
+        for save_future in save_futures:
+            save_future.result()
+        print(f"Segments from {filename} saved into {target_segment_directory}/{filename}")
+
+    return sub_segment_list, text_list
+
+def iter_segment_pdf(pdfs : list[tuple],  
+                     target_segment_directory : str = None, 
+                     expand:  bool = True,
+                     get_text : bool = False,
+                     molecules_of_the_month : bool = True,
+                     text_direction : str = 'right',
+                     max_workers : int = 2,
+                     dpi : int = 300,
+                     thread_count : int = None
+                     ) -> Iterator[tuple[
+                         list[tuple[str, int, int, np.ndarray]], 
+                         list[str] 
+                         ]]:
+    """
+    Segment PDFs in worker processes, yielding the (segments, texts) of each PDF in input order.
+
+    All PDFs are submitted to the workers at once, so the remaining PDFs keep being segmented
+    while the caller processes the results that were already yielded.
+    See segment_pdf for documentation of the parameters.
+    """
+    # prep saving directory
+    if target_segment_directory:
+        os.makedirs(target_segment_directory, exist_ok=True)
+
+    # every worker holds the rasterized pages of a whole pdf and its own segmentation model
+    max_workers = max(1, min(len(pdfs), max_workers))
+    if thread_count is None:
+        thread_count = max(1, (os.cpu_count() or 1) // max_workers)
+
+    segment_one_pdf = partial(
+        _segment_one_pdf,
+        target_segment_directory=target_segment_directory,
+        expand=expand,
+        get_text=get_text,
+        molecules_of_the_month=molecules_of_the_month,
+        text_direction=text_direction,
+        dpi=dpi,
+        thread_count=thread_count
+    )
+
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        yield from executor.map(segment_one_pdf, pdfs)
+    finally:
+        # if the caller stops early (e.g. recognition failed), the error surfaces right away
+        # instead of after the remaining pdfs are segmented, pdfs that were not started yet are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
 
 def segment_pdf(pdfs : list[tuple],  
                 target_segment_directory : str = None, 
                 expand:  bool = True,
                 get_text : bool = False,
                 molecules_of_the_month : bool = True,
-                text_direction : str = 'right'
+                text_direction : str = 'right',
+                max_workers : int = 2,
+                dpi : int = 300,
+                thread_count : int = None
                 ) -> tuple[
-                    list[tuple[str, int, bytes]], 
+                    list[tuple[str, int, int, np.ndarray]], 
                     list[str] 
                     ]:
     """
     Segment chemical structures from PDF pages using the decimer_segmentation library.
 
+    Each PDF is rasterized and segmented in its own worker process.
+
     Parameters:
         pdfs (list[tuple]): A list of tuples containing the PDF filename and its content in bytes.
         directory (str): The path to the directory where the segmented images should be saved.
         expand (bool): If True, decimer_segmentation expands the masks generated by the model, for most purposes this is better.
         visualization (bool): If True, displays the segmentation for visual confirmation.
+        max_workers (int): Number of worker processes, each holds a rasterized PDF and a segmentation model in memory.
+        dpi (int): Resolution the PDF pages are rasterized at.
+        thread_count (int): Number of poppler threads rasterizing each PDF, defaults to splitting the CPUs between the workers.
 
     Returns:
-        list[tuple]: A list of tuples containing the filename and segmented images extracted from the PDF.
+        list[tuple]: A list of tuples (filename, page number, segment number, segment) with the segments as numpy arrays.
     """
     print("Segmenting...")
     segmentation_start = time()
-    
-    # prep saving directory
-    if target_segment_directory:
-        os.makedirs(target_segment_directory, exist_ok=True)
 
-    # segmentation
+    # segmentation, results are collected in the order of the input pdfs
     segment_list = []
     text_list = []
-    for (filename, content) in pdfs:
-
-        # process pdfs
-        try:
-            pages = convert_from_bytes(content, 300)
-        except Exception as e:
-            print(f"Error while processing {filename}: {str(e)}")
-            continue
-
-        # call the segmentation function
-        # visualization can be set to True for a visual confirmation of the segmentation
-        # expand=True yields better results than expand=False
-        sub_segment_list = []
-        print(f"Attempting to segment {filename}")
-
-        for page_num, page in enumerate(pages):
-            segments = []
-            if (molecules_of_the_month):
-                segments, bboxes = extract_content_with_borders(binarize_image(page))
-
-            if segments == []:
-                from decimer_segmentation import segment_chemical_structures
-                segments, bboxes = segment_chemical_structures(np.array(binarize_image(page)),
-                                                    expand=expand,
-                                                    visualization=False)
-            
-            sub_segment_list += [
-                (filename, page_num, segment_num, Image.fromarray(segment)) 
-                for segment_num, segment in enumerate(segments)
-            ]
-
-            if get_text:
-                if molecules_of_the_month:
-                    text_list += (extract_text(os.path.join('pdf_extraction/pdfs', filename), page_num, bboxes, 'right'))
-                else:
-                    text_list += (extract_text(os.path.join('pdf_extraction/pdfs', filename), page_num, bboxes, text_direction))
-
-
-        print(f"Found {len(sub_segment_list)} segments in {filename}")
-
-        # save to specified directory
-        if target_segment_directory:
-            os.makedirs(os.path.join(target_segment_directory, filename), exist_ok=True)
-            for index, (filename, _, _, segment) in enumerate(sub_segment_list):
-                segment.save(os.path.join(target_segment_directory, f"{filename}/{index}.png"))
-            print(f"Segments from {filename} saved into {target_segment_directory}/{filename}")
+    for sub_segment_list, sub_text_list in iter_segment_pdf(
+            pdfs, 
+            target_segment_directory=target_segment_directory, 
+            expand=expand, 
+            get_text=get_text, 
+            molecules_of_the_month=molecules_of_the_month, 
+            text_direction=text_direction, 
+            max_workers=max_workers, 
+            dpi=dpi, 
+            thread_count=thread_count
+            ):
         segment_list += sub_segment_list
+        text_list += sub_text_list
 
 
     print(f"{len(segment_list)} segments were segmented.\nSegmentation took {time() - segmentation_start} s\n({(time() - segmentation_start)/len(segment_list)} s per segment)")
@@ -1,26 +1,107 @@
-from chembl_webresource_client.unichem import unichem_client as unichem
-from time import sleep
+import re
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, local
+from time import monotonic, sleep
 
-def validate_inchikey_list(inchikey_list : list[str]) -> list[bool]:
-    print("Validating through unichem.connectivity()...")
+from chembl_webresource_client.http_errors import BaseHttpException, status_to_exception
+from chembl_webresource_client.unichem import UniChemClient
+from requests.exceptions import HTTPError, RetryError
+
+# minimal delay in seconds between two requests to UniChem, shared by all validating threads
+REQUEST_INTERVAL = 0.1
+
+_rate_limit_lock = Lock()
+_next_request_time = 0.0
+
+# the client closes its session after every request, so each thread uses its own client
+_thread_data = local()
+
+# http status of the client's exceptions, e.g. HttpNotFound -> 404
+_exception_to_status = {exception_class: status for status, exception_class in status_to_exception.items()}
+# the client retries 4xx responses itself, once it gives up urllib3 reports the status only in the message
+_retry_error_status = re.compile(r'too many (\d{3}) error responses')
+
+def _get_unichem_client() -> UniChemClient:
+    if not hasattr(_thread_data, 'unichem'):
+        _thread_data.unichem = UniChemClient()
+    return _thread_data.unichem
+
+def _wait_for_request_slot() -> None:
+    """
+    Block until the next request to UniChem may be sent, at most one request is started every REQUEST_INTERVAL seconds.
+    """
+    global _next_request_time
+    with _rate_limit_lock:
+        now = monotonic()
+        wait_time = _next_request_time - now
+        _next_request_time = max(now, _next_request_time) + REQUEST_INTERVAL
+    if wait_time > 0:
+        sleep(wait_time)
+
+def _get_error_status(error : Exception) -> int:
+    """
+    Get the http status code UniChem answered a failed request with, None if the request got no answer (timeouts, connection errors).
+    """
+    if isinstance(error, BaseHttpException):
+        return _exception_to_status.get(type(error))
+    if isinstance(error, HTTPError) and error.response is not None:
+        return error.response.status_code
+    if isinstance(error, RetryError):
+        match = _retry_error_status.search(str(error))
+        if match:
+            return int(match.group(1))
+    return None
+
+def validate_inchikey(inchikey : str, retries : int = 3) -> bool:
+    """
+    Validate a single InChIKey using the UniChem web service.
+
+    Parameters:
+        inchikey (str): InChIKey to validate.
+        retries (int): How many times a request failing for another reason than an unknown InChIKey
+                       (rate limiting, server errors, timeouts, connection errors) is retried.
+                       If all attempts fail, the InChIKey is reported and treated as invalid.
+
+    Returns:
+        bool: True if UniChem knows the InChIKey, False otherwise.
+    """
+    for attempt in range(retries + 1):
+        _wait_for_request_slot()
+        try:
+            _get_unichem_client().connectivity(inchikey)
+            return True
+        except Exception as error:
+            status = _get_error_status(error)
+            # UniChem does not know the InChIKey (404) or rejects it (other 4xx apart from rate limiting)
+            if status is not None and 400 <= status < 500 and status != 429:
+                return False
+            if attempt == retries:
+                print(f"Could not validate {inchikey}, treating it as invalid: {error}")
+                return False
+            sleep(2 ** attempt)
+
+def validate_inchikey_list(inchikey_list : list[str], max_workers : int = 8) -> list[bool]:
     """
     Validate a list of InChIKeys using the UniChem web service.
 
+    Every distinct InChIKey is queried only once, up to max_workers requests are in flight at a time,
+    while new requests are started at most every REQUEST_INTERVAL seconds.
+    Empty InChIKeys (unparsable recognitions) are invalid without querying UniChem.
+
     Parameters:
         inchikey_list (list[str]): A list of InChIKeys to validate.
+        max_workers (int): Maximum number of concurrent requests to UniChem.
 
     Returns:
         list[bool]: A list of validation results where True means the InChIKey is valid, and False means it's not valid.
     """
-    validation_list = []
-    for inchikey in inchikey_list:
-        try:
-            unichem.connectivity(inchikey)
-            validation_list.append(True)
-        except:
-            validation_list.append(False)
-        sleep(0.1)
-    return validation_list
+    print("Validating through unichem.connectivity()...")
+    unique_inchikeys = list(dict.fromkeys(inchikey for inchikey in inchikey_list if inchikey))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        validated = dict(zip(unique_inchikeys, executor.map(validate_inchikey, unique_inchikeys)))
+
+    return [validated.get(inchikey, False) for inchikey in inchikey_list]
 
 def main():
     """